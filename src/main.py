@@ -4,33 +4,61 @@ A FastAPI application for uploading and managing photos locally
 """
 
 import os
-import uuid
+import re
+import atexit
+import hashlib
+import queue
+import platform
+import asyncio
+import secrets
 import logging
-import json
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from stat import S_ISREG
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import aiofiles
-from PIL import Image
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
+import aiofiles.os
+import aiosqlite
+import orjson
+
+# Configure logging (unless start.py already did in this process). Worker and reload processes
+# start with no handlers, so they use the same LOG_LEVEL/LOG_FILE settings as start.py.
+# Records are queued and written by a background listener thread so request handlers never
+# block on log file I/O.
+if not logging.getLogger().handlers:
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(
+        log_queue,
+        logging.FileHandler(os.getenv('LOG_FILE', 'app.log'), encoding='utf-8'),
         logging.StreamHandler()
-    ]
-)
+    )
+    logging.basicConfig(
+        level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[QueueHandler(log_queue)]
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# Accepted upload types
+ALLOWED_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff'})
+ALLOWED_MIME_TYPES = frozenset({
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 
+    'image/bmp', 'image/tiff'
+})
+ALLOWED_EXTENSIONS_TEXT = ', '.join(sorted(ALLOWED_EXTENSIONS))
+
 # Configuration
 class Config:
     """Application configuration for local storage"""
@@ -38,24 +66,81 @@ class Config:
     def __init__(self):
         self.upload_dir = Path("uploads/photos")
         self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.metadata_dir = Path("uploads/metadata")
+        self.metadata_dir.mkdir(parents=True, exist_ok=True)
+        self.metadata_db = self.metadata_dir / "metadata.sqlite3"
+        # In-progress uploads, on the same filesystem as upload_dir so finished files can be renamed in
+        self.temp_dir = Path("uploads/tmp")
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
         
         # File upload limits
         self.max_file_size = 100 * 1024 * 1024  # 100MB
-        self.allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff'}
-        self.allowed_mime_types = {
-            'image/jpeg', 'image/png', 'image/gif', 'image/webp', 
-            'image/bmp', 'image/tiff'
-        }
+        self.upload_chunk_size = 1024 * 1024  # 1MB streaming read size
+        self.max_form_overhead = 64 * 1024  # Multipart boundaries and form fields on top of the file
+        self.stale_upload_age = 10 * 60  # Seconds without writes before an upload temp file counts as abandoned
+        self.allowed_extensions = ALLOWED_EXTENSIONS
+        self.allowed_mime_types = ALLOWED_MIME_TYPES
 
 config = Config()
 
+# MIME types served for stored photos, by file extension
+EXTENSION_MIME_TYPES = {
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+    '.webp': 'image/webp', '.bmp': 'image/bmp', '.tiff': 'image/tiff'
+}
+
+# Browser/CDN caching for served images, and the single byte range form accepted in Range headers
+IMAGE_CACHE_CONTROL = "public, max-age=3600"
+BYTE_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+# Metadata index: one row per photo instead of one JSON sidecar file per photo
+METADATA_SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS photos (
+    filename TEXT PRIMARY KEY,
+    original_filename TEXT,
+    content_type TEXT,
+    file_size INTEGER,
+    upload_timestamp TEXT,
+    tags TEXT,
+    sort_timestamp TEXT NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_photos_sort_timestamp ON photos (sort_timestamp);
+CREATE INDEX IF NOT EXISTS idx_photos_content_hash ON photos (content_hash);
+UPDATE photos SET tags = CAST(tags AS TEXT) WHERE typeof(tags) = 'blob';
+"""
+PHOTO_COLUMNS = (
+    "filename, original_filename, content_type, file_size, upload_timestamp, tags, sort_timestamp, content_hash"
+)
+INSERT_PHOTO_SQL = f"INSERT OR REPLACE INTO photos ({PHOTO_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+# Scans never overwrite a row an upload wrote in the meantime
+INDEX_PHOTO_SQL = f"INSERT OR IGNORE INTO photos ({PHOTO_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Characters stripped from uploaded filenames (keeps letters, digits, '-' and '_')
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w-]+')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Clear abandoned uploads and open the metadata database at startup, close it on shutdown"""
+    # Uploads interrupted by a crash or kill leave their temp files behind
+    removed = await asyncio.to_thread(photo_uploader._remove_partial_uploads)
+    if removed:
+        logger.warning("Removed %d interrupted uploads", removed)
+    
+    await photo_uploader._get_db()
+    yield
+    await photo_uploader.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="🖼️ Local Photo Uploader",
     description="A FastAPI application for uploading and managing photos locally",
     version="1.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware for development
@@ -77,32 +162,47 @@ class LocalPhotoUploader:
     def __init__(self):
         self.config = config
         
+        # Metadata index connection, opened lazily on first use
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        
+        # Upload directory mtime at the last scan for photos added outside the app
+        self._indexed_dir_mtime: Optional[int] = None
+        self._index_lock = asyncio.Lock()
+        
+    def _get_extension(self, filename: str) -> str:
+        """Get the lowercase extension (including the dot) of a filename"""
+        # Like Path.suffix, a name that is only a dot-prefixed extension (e.g. '.jpg') has none
+        stem, dot, extension = filename.rpartition('.')
+        return f".{extension.lower()}" if dot and stem and extension else ""
+    
     def _validate_file(self, file: UploadFile) -> None:
         """Validate uploaded file"""
         # Check file extension
-        file_extension = Path(file.filename or "").suffix.lower()
-        if file_extension not in self.config.allowed_extensions:
+        file_extension = self._get_extension(file.filename or "")
+        if file_extension not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
                 detail=f"File type '{file_extension}' not allowed. "
-                       f"Allowed types: {', '.join(self.config.allowed_extensions)}"
+                       f"Allowed types: {ALLOWED_EXTENSIONS_TEXT}"
             )
         
         # Check MIME type
-        if file.content_type not in self.config.allowed_mime_types:
+        if file.content_type not in ALLOWED_MIME_TYPES:
             raise HTTPException(
                 status_code=400,
                 detail=f"MIME type '{file.content_type}' not allowed"
             )
     
-    def _generate_filename(self, original_filename: str) -> str:
-        """Generate a unique filename with timestamp and UUID"""
-        timestamp = datetime.utcnow().strftime("%Y-%m-%d")
-        file_extension = Path(original_filename).suffix.lower()
-        unique_id = str(uuid.uuid4())[:8]
+    def _generate_filename(self, original_filename: str, uploaded_at: datetime) -> str:
+        """Generate a unique filename with upload date and random ID"""
+        timestamp = uploaded_at.strftime("%Y-%m-%d")
+        file_extension = self._get_extension(original_filename)
+        unique_id = secrets.token_hex(4)
         
         # Clean filename
-        clean_name = "".join(c for c in Path(original_filename).stem if c.isalnum() or c in ('-', '_'))
+        stem, dot, _ = original_filename.rpartition('.')
+        clean_name = UNSAFE_FILENAME_CHARS.sub('', stem if dot else original_filename)
         clean_name = clean_name[:50]  # Limit length
         
         return f"{timestamp}_{clean_name}_{unique_id}{file_extension}"
@@ -111,10 +211,207 @@ class LocalPhotoUploader:
         """Get full file path for a given filename"""
         return self.config.upload_dir / filename
     
+    def _stat_photo(self, filename: str) -> os.stat_result:
+        """Stat a stored photo, raising 404 if it is not a regular file"""
+        try:
+            stat = self._get_file_path(filename).stat()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        
+        if not S_ISREG(stat.st_mode):
+            raise HTTPException(status_code=404, detail="Photo not found")
+        return stat
+    
     def _get_metadata_path(self, filename: str) -> Path:
         """Get metadata file path for a given filename"""
         return self.config.upload_dir / f"{filename}.metadata.json"
     
+    def _load_metadata(self, filename: str) -> dict:
+        """Load a legacy metadata sidecar for a photo, or an empty dict if unavailable"""
+        metadata_path = self._get_metadata_path(filename)
+        if not metadata_path.exists():
+            return {}
+        
+        try:
+            with open(metadata_path, 'rb') as f:
+                return orjson.loads(f.read())
+        except Exception as e:
+            logger.warning("Failed to load metadata for %s: %s", filename, e)
+            return {}
+    
+    def _metadata_to_row(
+        self,
+        filename: str,
+        metadata: dict,
+        sort_timestamp: str,
+        content_hash: Optional[str] = None
+    ) -> tuple:
+        """Convert a metadata dict into a photos table row"""
+        tags = metadata.get('tags')
+        return (
+            filename,
+            metadata.get('original_filename'),
+            metadata.get('content_type'),
+            metadata.get('file_size'),
+            metadata.get('upload_timestamp'),
+            orjson.dumps(tags).decode() if tags else None,
+            sort_timestamp,
+            content_hash
+        )
+    
+    def _row_to_metadata(self, row: aiosqlite.Row) -> dict:
+        """Convert a photos table row back into a metadata dict"""
+        if row['upload_timestamp'] is None:
+            # Photo was indexed without any recorded upload metadata
+            return {}
+        
+        metadata = {
+            'original_filename': row['original_filename'],
+            'upload_timestamp': row['upload_timestamp'],
+            'content_type': row['content_type'],
+            'file_size': row['file_size'],
+            'filename': row['filename']
+        }
+        if row['tags']:
+            metadata['tags'] = orjson.loads(row['tags'])
+        return metadata
+    
+    def _collect_unindexed_photos(self, indexed: set) -> List[tuple]:
+        """Build rows for image files missing from the index (blocking, run in a worker thread)"""
+        rows = []
+        allowed_suffixes = tuple(self.config.allowed_extensions)
+        
+        # DirEntry.is_file() uses the type returned by the directory read, so it needs no extra stat
+        with os.scandir(self.config.upload_dir) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(allowed_suffixes) or not entry.is_file():
+                    continue
+                if entry.name not in indexed:
+                    # Sort by upload time, falling back to the file's mtime when it was never recorded
+                    metadata = self._load_metadata(entry.name)
+                    sort_timestamp = (
+                        metadata.get('upload_timestamp')
+                        or datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc).isoformat()
+                    )
+                    rows.append(self._metadata_to_row(entry.name, metadata, sort_timestamp))
+        
+        return rows
+    
+    def _remove_partial_uploads(self) -> int:
+        """Delete abandoned '<name>.part' upload temp files (blocking)"""
+        # Other workers may be streaming uploads right now, so only remove files that stopped growing
+        cutoff = datetime.now(timezone.utc).timestamp() - self.config.stale_upload_age
+        removed = 0
+        with os.scandir(self.config.temp_dir) as entries:
+            for entry in entries:
+                if not (entry.name.endswith('.part') and entry.is_file()):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        Path(entry.path).unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # Finished or removed by its upload in the meantime
+        return removed
+    
+    async def _get_db(self) -> aiosqlite.Connection:
+        """Get the metadata database connection, creating and indexing it on first use"""
+        async with self._db_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self.config.metadata_db)
+                db.row_factory = aiosqlite.Row
+                await db.executescript(METADATA_SCHEMA)
+                
+                # Index photos already on disk (including legacy JSON sidecars)
+                self._indexed_dir_mtime = self.config.upload_dir.stat().st_mtime_ns
+                await self._index_new_photos(db)
+                
+                self._db = db
+            return self._db
+    
+    async def _index_new_photos(self, db: aiosqlite.Connection) -> None:
+        """Add image files on disk that are missing from the index"""
+        async with db.execute("SELECT filename FROM photos") as cursor:
+            indexed = {row['filename'] for row in await cursor.fetchall()}
+        rows = await asyncio.to_thread(self._collect_unindexed_photos, indexed)
+        if rows:
+            await db.executemany(INDEX_PHOTO_SQL, rows)
+            await db.commit()
+            logger.info("✅ Indexed %d new photos", len(rows))
+    
+    async def _refresh_index(self, db: aiosqlite.Connection) -> None:
+        """Index photos copied into the upload directory while running, if the directory changed"""
+        dir_mtime = self.config.upload_dir.stat().st_mtime_ns
+        if dir_mtime == self._indexed_dir_mtime:
+            return
+        
+        async with self._index_lock:
+            if dir_mtime != self._indexed_dir_mtime:
+                # Record the mtime before scanning so changes made during the scan trigger another pass
+                self._indexed_dir_mtime = dir_mtime
+                await self._index_new_photos(db)
+    
+    def _skip_rescan_for_own_change(self, dir_mtime_before: int) -> None:
+        """Keep the index current after the app itself changed upload_dir, if nothing else had changed it"""
+        if dir_mtime_before == self._indexed_dir_mtime:
+            self._indexed_dir_mtime = self.config.upload_dir.stat().st_mtime_ns
+    
+    async def _save_metadata(self, metadata: dict, content_hash: str) -> None:
+        """Insert or replace a photo's metadata in the index"""
+        db = await self._get_db()
+        await db.execute(
+            INSERT_PHOTO_SQL,
+            self._metadata_to_row(metadata['filename'], metadata, metadata['upload_timestamp'], content_hash)
+        )
+        await db.commit()
+    
+    async def _merge_tags(self, row: aiosqlite.Row, tags: dict) -> bool:
+        """Merge new tags into an indexed photo's existing tags, returning whether they changed"""
+        existing = orjson.loads(row['tags']) if row['tags'] else {}
+        merged = {**existing, **tags}
+        if merged == existing:
+            return False
+        
+        db = await self._get_db()
+        await db.execute(
+            "UPDATE photos SET tags = ? WHERE filename = ?",
+            (orjson.dumps(merged).decode(), row['filename'])
+        )
+        await db.commit()
+        return True
+    
+    async def _find_photo_by_hash(self, content_hash: str) -> Optional[aiosqlite.Row]:
+        """Find an indexed photo with identical content that is still on disk"""
+        db = await self._get_db()
+        async with db.execute(
+            f"SELECT {PHOTO_COLUMNS} FROM photos WHERE content_hash = ?",
+            (content_hash,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        
+        for row in rows:
+            if self._get_file_path(row['filename']).is_file():
+                return row
+        return None
+    
+    async def close(self) -> None:
+        """Close the metadata database connection"""
+        async with self._db_lock:
+            if self._db is not None:
+                await self._db.close()
+                self._db = None
+    
+    def _build_photo_info(self, filename: str, stat: os.stat_result, metadata: dict) -> dict:
+        """Build the photo listing entry from file stats and metadata"""
+        return {
+            'filename': filename,
+            'size': stat.st_size,
+            'last_modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'content_type': metadata.get('content_type', 'image/jpeg'),
+            'url': f"/api/photos/{filename}/image",
+            'metadata': metadata
+        }
+    
     async def upload_photo(
         self, 
         file: UploadFile, 
@@ -125,61 +422,84 @@ class LocalPhotoUploader:
             # Validate file
             self._validate_file(file)
             
-            # Read file content
-            file_content = await file.read()
-            file_size = len(file_content)
-            
-            # Check file size
-            if file_size > self.config.max_file_size:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"File too large. Maximum size: {self.config.max_file_size // 1024 // 1024}MB"
-                )
-            
-            if file_size == 0:
-                raise HTTPException(status_code=400, detail="Empty file not allowed")
-            
             # Generate unique filename
-            filename = self._generate_filename(file.filename or f"photo_{uuid.uuid4()}")
+            uploaded_at = datetime.now(timezone.utc)
+            filename = self._generate_filename(file.filename or f"photo_{secrets.token_hex(8)}", uploaded_at)
             file_path = self._get_file_path(filename)
-            metadata_path = self._get_metadata_path(filename)
             
-            # Save file
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(file_content)
+            # Stream file to a temporary file in chunks, enforcing the size limit as we go.
+            # It is only moved into place once complete, so a crash never leaves a partial photo.
+            temp_path = self.config.temp_dir / f"{filename}.part"
+            file_size = 0
+            hasher = hashlib.sha256()
+            try:
+                async with aiofiles.open(temp_path, 'wb') as f:
+                    while chunk := await file.read(self.config.upload_chunk_size):
+                        file_size += len(chunk)
+                        if file_size > self.config.max_file_size:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"File too large. Maximum size: {self.config.max_file_size // 1024 // 1024}MB"
+                            )
+                        # Hash in a worker thread (hashlib releases the GIL) while the chunk is written
+                        await asyncio.gather(f.write(chunk), asyncio.to_thread(hasher.update, chunk))
+                
+                if file_size == 0:
+                    raise HTTPException(status_code=400, detail="Empty file not allowed")
+                
+                # Identical content is already stored: keep the existing photo and drop this copy
+                content_hash = hasher.hexdigest()
+                existing = await self._find_photo_by_hash(content_hash)
+                if existing is not None:
+                    logger.info("✅ Duplicate upload matched existing photo: %s", existing['filename'])
+                    tags_updated = bool(tags) and await self._merge_tags(existing, tags)
+                    return {
+                        'success': True,
+                        'duplicate': True,
+                        'tags_updated': tags_updated,
+                        'filename': existing['filename'],
+                        'file_path': str(self._get_file_path(existing['filename'])),
+                        'file_size': existing['file_size'],
+                        'content_type': existing['content_type'],
+                        'upload_timestamp': existing['upload_timestamp']
+                    }
+                
+                dir_mtime = self.config.upload_dir.stat().st_mtime_ns
+                await aiofiles.os.replace(temp_path, file_path)
+                self._skip_rescan_for_own_change(dir_mtime)
+            finally:
+                temp_path.unlink(missing_ok=True)
             
             # Create metadata
+            upload_timestamp = uploaded_at.isoformat()
             metadata = {
                 'original_filename': file.filename or 'unknown',
-                'upload_timestamp': datetime.utcnow().isoformat(),
+                'upload_timestamp': upload_timestamp,
                 'content_type': file.content_type or 'application/octet-stream',
                 'file_size': file_size,
-                'filename': filename
+                'filename': filename,
+                **({'tags': tags} if tags else {})  # Custom tags, if provided
             }
             
-            # Add custom tags if provided
-            if tags:
-                metadata['tags'] = tags
+            # Save metadata only after the photo is in place, so the index never points at a missing file
+            await self._save_metadata(metadata, content_hash)
             
-            # Save metadata
-            async with aiofiles.open(metadata_path, 'w') as f:
-                await f.write(json.dumps(metadata, indent=2))
-            
-            logger.info(f"✅ Successfully uploaded photo: {filename} ({file_size} bytes)")
+            logger.info("✅ Successfully uploaded photo: %s (%d bytes)", filename, file_size)
             
             return {
                 'success': True,
+                'duplicate': False,
                 'filename': filename,
                 'file_path': str(file_path),
                 'file_size': file_size,
                 'content_type': file.content_type,
-                'upload_timestamp': datetime.utcnow().isoformat()
+                'upload_timestamp': upload_timestamp
             }
             
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"❌ Unexpected error during upload: {e}")
+            logger.error("❌ Unexpected error during upload: %s", e)
             raise HTTPException(
                 status_code=500,
                 detail=f"Upload failed: {str(e)}"
@@ -188,87 +508,85 @@ class LocalPhotoUploader:
             # Reset file pointer for potential reuse
             await file.seek(0)
     
+    def _hydrate_photo_rows(self, rows: List[aiosqlite.Row]) -> tuple[List[dict], List[tuple]]:
+        """Build photo entries for index rows, returning them with rows whose file is missing (blocking)"""
+        photos = []
+        missing = []
+        for row in rows:
+            try:
+                stat = self._get_file_path(row['filename']).stat()
+            except FileNotFoundError:
+                missing.append((row['filename'],))
+                continue
+            photos.append(self._build_photo_info(row['filename'], stat, self._row_to_metadata(row)))
+        return photos, missing
+    
     async def list_photos(self, limit: int = 50) -> List[dict]:
         """List photos in the local storage"""
         try:
-            photos = []
-            
-            # Get all image files
-            for file_path in self.config.upload_dir.glob("*"):
-                if file_path.is_file() and file_path.suffix.lower() in self.config.allowed_extensions:
-                    # Try to load metadata
-                    metadata_path = self._get_metadata_path(file_path.name)
-                    metadata = {}
-                    
-                    if metadata_path.exists():
-                        try:
-                            async with aiofiles.open(metadata_path, 'r') as f:
-                                content = await f.read()
-                                metadata = json.loads(content)
-                        except Exception as e:
-                            logger.warning(f"Failed to load metadata for {file_path.name}: {e}")
-                    
-                    # Get file stats
-                    stat = file_path.stat()
-                    
-                    photo_info = {
-                        'filename': file_path.name,
-                        'size': stat.st_size,
-                        'last_modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        'content_type': metadata.get('content_type', 'image/jpeg'),
-                        'url': f"/api/photos/{file_path.name}/image",
-                        'metadata': metadata
-                    }
-                    
-                    photos.append(photo_info)
-                    
-                    if len(photos) >= limit:
-                        break
+            db = await self._get_db()
+            await self._refresh_index(db)
             
-            # Sort by upload time (newest first)
-            photos.sort(key=lambda x: x.get('metadata', {}).get('upload_timestamp', ''), reverse=True)
+            while True:
+                # Newest first, using the sort key precomputed when each photo was indexed
+                async with db.execute(
+                    f"SELECT {PHOTO_COLUMNS} FROM photos ORDER BY sort_timestamp DESC LIMIT ?",
+                    (limit,)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                
+                # Stat all listed files in one worker thread rather than one blocking call per photo
+                photos, missing = await asyncio.to_thread(self._hydrate_photo_rows, rows)
+                if not missing:
+                    break
+                
+                # Drop index rows for files removed outside the app and query again to fill their slots
+                await db.executemany("DELETE FROM photos WHERE filename = ?", missing)
+                await db.commit()
+                logger.warning("Removed %d missing photos from the index", len(missing))
             
-            logger.info(f"✅ Listed {len(photos)} photos")
+            logger.info("✅ Listed %d photos", len(photos))
             return photos
             
         except Exception as e:
-            logger.error(f"❌ Error listing photos: {e}")
+            logger.error("❌ Error listing photos: %s", e)
             raise HTTPException(status_code=500, detail=f"Failed to list photos: {str(e)}")
     
-    async def get_photo_data(self, filename: str) -> tuple[bytes, str]:
-        """Get photo data and content type from local storage"""
+    async def get_photo_metadata(self, filename: str) -> dict:
+        """Get photo details and metadata from local storage"""
         try:
-            file_path = self._get_file_path(filename)
-            
-            if not file_path.exists():
-                raise HTTPException(status_code=404, detail="Photo not found")
-            
-            # Read file
-            async with aiofiles.open(file_path, 'rb') as f:
-                content = await f.read()
+            stat = self._stat_photo(filename)
             
-            # Try to get content type from metadata
-            metadata_path = self._get_metadata_path(filename)
-            content_type = 'image/jpeg'  # default
+            db = await self._get_db()
+            async with db.execute(
+                f"SELECT {PHOTO_COLUMNS} FROM photos WHERE filename = ?",
+                (filename,)
+            ) as cursor:
+                row = await cursor.fetchone()
             
-            if metadata_path.exists():
-                try:
-                    async with aiofiles.open(metadata_path, 'r') as f:
-                        metadata_content = await f.read()
-                        metadata = json.loads(metadata_content)
-                        content_type = metadata.get('content_type', content_type)
-                except Exception as e:
-                    logger.warning(f"Failed to load metadata for content type: {e}")
+            metadata = self._row_to_metadata(row) if row else {}
+            photo_info = self._build_photo_info(filename, stat, metadata)
             
-            logger.info(f"✅ Retrieved photo data for: {filename} ({len(content)} bytes)")
-            return content, content_type
+            logger.info("✅ Retrieved photo metadata for: %s", filename)
+            return photo_info
             
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"❌ Error retrieving photo {filename}: {e}")
+            logger.error("❌ Error retrieving photo %s: %s", filename, e)
             raise HTTPException(status_code=500, detail=f"Failed to retrieve photo: {str(e)}")
 
+    async def iter_photo_range(self, filename: str, start: int, length: int):
+        """Yield a byte range of a stored photo in chunks"""
+        async with aiofiles.open(self._get_file_path(filename), 'rb') as f:
+            await f.seek(start)
+            while length > 0:
+                chunk = await f.read(min(self.config.upload_chunk_size, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
     async def delete_photo(self, filename: str) -> bool:
         """Delete a photo from local storage"""
         try:
@@ -279,24 +597,98 @@ class LocalPhotoUploader:
                 raise HTTPException(status_code=404, detail="Photo not found")
             
             # Delete main file
+            dir_mtime = self.config.upload_dir.stat().st_mtime_ns
             file_path.unlink()
             
-            # Delete metadata file if it exists
+            # Delete legacy metadata file if it exists
             if metadata_path.exists():
                 metadata_path.unlink()
+            self._skip_rescan_for_own_change(dir_mtime)
+            
+            db = await self._get_db()
+            await db.execute("DELETE FROM photos WHERE filename = ?", (filename,))
+            await db.commit()
             
-            logger.info(f"✅ Successfully deleted photo: {filename}")
+            logger.info("✅ Successfully deleted photo: %s", filename)
             return True
             
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"❌ Error deleting photo {filename}: {e}")
+            logger.error("❌ Error deleting photo %s: %s", filename, e)
             raise HTTPException(status_code=500, detail=f"Failed to delete photo: {str(e)}")
 
 # Initialize the photo uploader
 photo_uploader = LocalPhotoUploader()
 
+def is_not_modified(request: Request, etag: str, stat: os.stat_result) -> bool:
+    """Check the request's conditional headers against the photo's ETag and mtime"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag in tags or "*" in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_byte_range(range_header: str, file_size: int) -> Optional[tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range into inclusive offsets, or None to serve the whole file"""
+    match = BYTE_RANGE.fullmatch(range_header.strip())
+    if match is None or match.groups() == ('', ''):
+        # Malformed or multi-range requests get the full file
+        return None
+    
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        if end and int(end) < start:
+            # Invalid range spec (last-pos before first-pos): ignore it, per RFC 9110
+            return None
+        end = min(int(end), file_size - 1) if end else file_size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(file_size - int(end), 0)
+        end = file_size - 1
+    
+    if start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is over the limit before the body is read.
+    
+    Plain ASGI middleware so every other request passes straight through untouched.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/upload":
+            declared_size = dict(scope["headers"]).get(b"content-length", b"")
+            if declared_size.isdigit() and int(declared_size) > config.max_file_size + config.max_form_overhead:
+                logger.warning("Rejected upload with declared size %s bytes", declared_size.decode())
+                response = templates.TemplateResponse("error.html", {
+                    "request": Request(scope),
+                    "error": f"File too large. Maximum size: {config.max_file_size // 1024 // 1024}MB",
+                    "status_code": 413
+                })
+                await response(scope, receive, send)
+                return
+        
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Routes
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -312,12 +704,8 @@ async def upload_photo(
 ):
     """Upload photo endpoint"""
     try:
-        # Prepare tags from form data
-        tags = {}
-        if album:
-            tags['album'] = album
-        if description:
-            tags['description'] = description
+        # Prepare tags from non-empty form fields
+        tags = {key: value for key, value in (('album', album), ('description', description)) if value}
         
         result = await photo_uploader.upload_photo(file, tags=tags)
         
@@ -335,7 +723,7 @@ async def upload_photo(
             "status_code": e.status_code
         })
     except Exception as e:
-        logger.error(f"❌ Unexpected error in upload endpoint: {e}")
+        logger.error("❌ Unexpected error in upload endpoint: %s", e)
         return templates.TemplateResponse("error.html", {
             "request": request,
             "error": "An unexpected error occurred",
@@ -346,39 +734,76 @@ async def upload_photo(
 async def get_photos(limit: int = 50):
     """API endpoint to get photos list"""
     photos = await photo_uploader.list_photos(limit=limit)
-    return JSONResponse({"photos": photos, "count": len(photos)})
+    return ORJSONResponse({"photos": photos, "count": len(photos)})
 
 @app.get("/api/photos/{filename}/details")
 async def get_photo_details(filename: str):
     """API endpoint to get details for a specific photo"""
     try:
-        # Get photo data (this will validate the file exists and load metadata)
-        photo_data = await photo_uploader.get_photo_data(filename)
-        if photo_data:
-            return JSONResponse(photo_data)
-        else:
-            raise HTTPException(status_code=404, detail="Photo not found")
+        # Get photo metadata (this will validate the file exists); image bytes are served by /image
+        photo_info = await photo_uploader.get_photo_metadata(filename)
+        return ORJSONResponse(photo_info)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting photo details for {filename}: {e}")
+        logger.error("Error getting photo details for %s: %s", filename, e)
         raise HTTPException(status_code=500, detail="Failed to get photo details")
 
 @app.get("/api/photos/{filename}/image")
-async def get_photo_image(filename: str):
+async def get_photo_image(filename: str, request: Request):
     """API endpoint to serve photo image data"""
     try:
         file_path = photo_uploader._get_file_path(filename)
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Photo not found")
+        stat = photo_uploader._stat_photo(filename)
+        
+        # Content type comes from the extension; only unknown extensions need the metadata index
+        media_type = EXTENSION_MIME_TYPES.get(photo_uploader._get_extension(filename))
+        if media_type is None:
+            media_type = (await photo_uploader.get_photo_metadata(filename))['content_type']
         
-        return FileResponse(
+        # FileResponse streams the file from disk in chunks, so memory stays flat regardless of image size.
+        # It also sets ETag and Last-Modified from the stat result.
+        response = FileResponse(
             path=str(file_path),
-            media_type="image/jpeg",
-            filename=filename
+            media_type=media_type,
+            filename=filename,
+            headers={"Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"},
+            stat_result=stat  # Reuse our stat so FileResponse doesn't stat the file again
         )
+        cache_headers = {
+            "ETag": response.headers["etag"],
+            "Last-Modified": response.headers["last-modified"],
+            "Cache-Control": IMAGE_CACHE_CONTROL
+        }
+        
+        # The client's cached copy is current: skip sending the body
+        if is_not_modified(request, cache_headers["ETag"], stat):
+            return Response(status_code=304, headers=cache_headers)
+        
+        # Partial content, unless If-Range says the client's copy is stale
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (if_range is None or if_range == cache_headers["ETag"]):
+            byte_range = parse_byte_range(range_header, stat.st_size)
+            if byte_range is not None:
+                start, end = byte_range
+                return StreamingResponse(
+                    photo_uploader.iter_photo_range(filename, start, end - start + 1),
+                    status_code=206,
+                    media_type=media_type,
+                    headers={
+                        **cache_headers,
+                        "Accept-Ranges": "bytes",
+                        "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+                        "Content-Length": str(end - start + 1)
+                    }
+                )
+        
+        return response
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error serving image {filename}: {e}")
+        logger.error("❌ Error serving image %s: %s", filename, e)
         raise HTTPException(status_code=500, detail="Failed to serve image")
 
 @app.get("/gallery", response_class=HTMLResponse)
@@ -391,7 +816,7 @@ async def photo_gallery(request: Request, limit: int = 20):
             "photos": photos
         })
     except Exception as e:
-        logger.error(f"❌ Error loading gallery: {e}")
+        logger.error("❌ Error loading gallery: %s", e)
         return templates.TemplateResponse("error.html", {
             "request": request,
             "error": "Failed to load photo gallery",
@@ -402,20 +827,21 @@ async def photo_gallery(request: Request, limit: int = 20):
 async def delete_photo_endpoint(filename: str):
     """API endpoint to delete a photo"""
     success = await photo_uploader.delete_photo(filename)
-    return JSONResponse({"success": success, "message": f"Photo {filename} deleted successfully"})
+    return ORJSONResponse({"success": success, "message": f"Photo {filename} deleted successfully"})
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    timestamp = datetime.now(timezone.utc).isoformat()
     try:
         # Simple health check - verify upload directory exists
         if config.upload_dir.exists():
-            return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+            return {"status": "healthy", "timestamp": timestamp}
         else:
-            return {"status": "unhealthy", "error": "Upload directory not found", "timestamp": datetime.utcnow().isoformat()}
+            return {"status": "unhealthy", "error": "Upload directory not found", "timestamp": timestamp}
     except Exception as e:
-        logger.error(f"❌ Health check failed: {e}")
-        return {"status": "unhealthy", "error": str(e), "timestamp": datetime.utcnow().isoformat()}
+        logger.error("❌ Health check failed: %s", e)
+        return {"status": "unhealthy", "error": str(e), "timestamp": timestamp}
 
 # Error handlers
 @app.exception_handler(404)
@@ -428,7 +854,7 @@ async def not_found_handler(request: Request, exc):
 
 @app.exception_handler(500)
 async def internal_error_handler(request: Request, exc):
-    logger.error(f"❌ Internal server error: {exc}")
+    logger.error("❌ Internal server error: %s", exc)
     return templates.TemplateResponse("error.html", {
         "request": request,
         "error": "Internal server error",
@@ -442,5 +868,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        loop="asyncio" if platform.system() == "Windows" else "uvloop",
+        http="httptools",
         log_level="info"
     )
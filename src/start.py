@@ -6,10 +6,16 @@ Handles local environment configuration and application initialization
 
 import os
 import sys
+import queue
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import platform
 from pathlib import Path
 
+# Resolved once at import; selects console-safe log messages and the event loop
+IS_WINDOWS = platform.system() == 'Windows'
+
 def setup_logging():
     """Configure application logging with proper Unicode handling"""
     log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -19,7 +25,7 @@ def setup_logging():
     file_handler = logging.FileHandler(log_file, encoding='utf-8')
     
     # For Windows, configure console handler with UTF-8 encoding
-    if platform.system() == 'Windows':
+    if IS_WINDOWS:
         # Try to set console to UTF-8, fallback to safe logging
         try:
             import codecs
@@ -31,17 +37,23 @@ def setup_logging():
     else:
         stream_handler = logging.StreamHandler()
     
+    # Write log records from a background thread so the event loop never blocks on log I/O
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, file_handler, stream_handler)
+    
     logging.basicConfig(
         level=getattr(logging, log_level),
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[file_handler, stream_handler],
+        handlers=[QueueHandler(log_queue)],
         force=True  # Override any existing configuration
     )
+    log_listener.start()
+    atexit.register(log_listener.stop)
     
     logger = logging.getLogger(__name__)
     
     # Use platform-appropriate messages
-    if platform.system() == 'Windows':
+    if IS_WINDOWS:
         logger.info(f"[STARTING] Photo Uploader application with log level: {log_level}")
     else:
         logger.info(f"🚀 Starting Photo Uploader application with log level: {log_level}")
@@ -75,7 +87,7 @@ def main():
     os.environ.setdefault('APP_PORT', '8000')
     
     # Use platform-appropriate logging messages
-    if platform.system() == 'Windows':
+    if IS_WINDOWS:
         logger.info("[OK] Local photo uploader ready")
         logger.info("[STORAGE] Using local file system storage")
     else:
@@ -89,28 +101,37 @@ def main():
     port = int(os.getenv('APP_PORT', '8000'))
     debug = os.getenv('APP_DEBUG', 'false').lower() == 'true'
     
-    if platform.system() == 'Windows':
+    if IS_WINDOWS:
         logger.info(f"[SERVER] Starting server on http://{host}:{port}")
     else:
         logger.info(f"🌐 Starting server on http://{host}:{port}")
     
-    # Use import string when reload is enabled, otherwise import the app object
+    # uvloop and httptools replace the pure-Python event loop and HTTP parser (uvloop is POSIX-only)
+    loop = 'asyncio' if IS_WINDOWS else 'uvloop'
+    
+    # Import string is required for both reload mode and multiple workers
     if debug:
         uvicorn.run(
             "main:app",  # Import string for reload mode
             host=host,
             port=port,
             reload=True,
+            loop=loop,
+            http='httptools',
             log_level=os.getenv('LOG_LEVEL', 'info').lower()
         )
     else:
-        # Import app object for production mode
-        from main import app
+        # One worker process (and event loop) per CPU so concurrent uploads don't queue behind each other
+        workers = int(os.getenv('APP_WORKERS') or max(2, os.cpu_count() or 2))
+        logger.info(f"Starting {workers} worker processes")
         uvicorn.run(
-            app,
+            "main:app",
             host=host,
             port=port,
             reload=False,
+            workers=workers,
+            loop=loop,
+            http='httptools',
             log_level=os.getenv('LOG_LEVEL', 'info').lower()
         )
 